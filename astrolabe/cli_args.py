@@ -72,6 +72,8 @@ def parse_args(registered_exporter_refs: List[str]) -> (configargparse.Namespace
                                  'e.g. "ssh:10.0.0.42" or "k8s:widget-machine-5b5bc8f67f-2qmkp')
     discover_p.add_argument('-t', '--timeout', type=int, default=60, metavar='TIMEOUT',
                             help='Timeout when discovering a node')
+    discover_p.add_argument('--init-timeout', type=int, default=300, metavar='TIMEOUT',
+                            help='Timeout for each provider to initialize, including any inventory it takes')
     discover_p.add_argument('-d', '--max-depth', type=int, default=100, metavar='DEPTH',
                             help='Max tree depth to discover')
     discover_p.add_argument('-X', '--disable-providers', nargs='+', default=[], metavar='PROVIDER',
@@ -7,11 +7,14 @@ Read and parse astrolabe specific config files such as network.yaml and Profile
 License:
 SPDX-License-Identifier: Apache-2.0
 """
+import os
 from pathlib import Path
 
 ROOT_DIR = Path.cwd()
 ASTROLABE_DIR = ROOT_DIR / 'astrolabe.d'
 CORE_ASTROLABE_DIR = Path(__file__).resolve().parent.parent / 'astrolabe.d'
+# per user cache of derived data, kept out of the (cwd relative) project directories
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'astrolabe'
 
 
 def get_config_yaml_files():
@@ -9,7 +9,8 @@ SPDX-License-Identifier: Apache-2.0
 """
 import os
 
-from typing import Dict, Optional
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
 from datetime import datetime
 
 from corelib import platdb
@@ -31,6 +32,16 @@ def close():
     NEO4J_CONNECTION.close()
 
 
+@contextmanager
+def connection() -> Iterator[None]:
+    """Open the neo4j connection for the duration of the block, closing it however the block exits"""
+    init()
+    try:
+        yield
+    finally:
+        close()
+
+
 def _neomodel_to_node(platdb_node: platdb.PlatDBNode) -> Node:
     class_to_node = {
         platdb.Compute: NodeType.COMPUTE,
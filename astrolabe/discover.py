@@ -10,6 +10,7 @@ SPDX-License-Identifier: Apache-2.0
 """
 
 import asyncio
+import logging
 import sys
 import traceback
 
@@ -152,7 +153,8 @@ async def _discover_node(node_ref: str, node: Node, ancestors: List[str]):
             database.connect_nodes(node, profiled_children[ref])
     except (providers.TimeoutException, asyncio.TimeoutError):
         logs.logger.debug("TIMEOUT attempting to connect to %s with address: %s", node_ref, node.address)
-        logs.logger.debug({**vars(node), 'profile_strategy': node.profile_strategy_name}, 'yellow')
+        if logs.logger.isEnabledFor(logging.DEBUG):
+            logs.logger.debug("%s", {**vars(node), 'profile_strategy': node.profile_strategy_name})
         node.errors['TIMEOUT'] = True
     except Exception as exc:
         dexc = DiscoveryException(exc)
@@ -265,9 +267,7 @@ async def _profile_node(node: Node, node_ref: str, connection: type) -> Dict[str
     # COMPILE PROFILE STRATEGIES
     tasks = []
     profile_strategies: List[ProfileStrategy] = []
-    for pfs in profile_strategy.profile_strategies:
-        if provider_ref not in pfs.providers:
-            continue
+    for pfs in profile_strategy.get_profile_strategies(provider_ref):
         if pfs.protocol.ref in constants.ARGS.skip_protocols:
             continue
         if pfs.filter_service_name(service_name):
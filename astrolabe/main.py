@@ -47,19 +47,18 @@ signal.signal(signal.SIGINT, lambda x, y: sys.exit(0))
 
 def main():
     print(f"Hello, {getpass.getuser()}", file=sys.stderr)
-    database.init()
-    plugin_core.import_plugin_classes()
-    _parse_builtin_args()
-    _set_debug_level()
-    profile_strategy.init()
-    _create_outputs_directory_if_absent()
-    command = _cli_command()
-    command.parse_args()
-    constants.ARGS, _ = cli_args.argparser.parse_known_args()
-    if constants.ARGS.debug:
-        constants.PP.pprint(constants.ARGS)
-    command.exec()
-    database.close()
+    with database.connection():
+        plugin_core.import_plugin_classes()
+        _parse_builtin_args()
+        _set_debug_level()
+        profile_strategy.init()
+        _create_outputs_directory_if_absent()
+        command = _cli_command()
+        command.parse_args()
+        constants.ARGS, _ = cli_args.argparser.parse_known_args()
+        if constants.ARGS.debug:
+            constants.PP.pprint(constants.ARGS)
+        command.exec()
     print(f"\nGoodbye, {getpass.getuser()}\n", file=sys.stderr)
 
 
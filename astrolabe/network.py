@@ -10,9 +10,10 @@ SPDX-License-Identifier: Apache-2.0
 """
 
 import ipaddress
+import re
 import sys
-from dataclasses import dataclass, asdict
-from typing import NamedTuple, Dict, List
+from dataclasses import dataclass
+from typing import NamedTuple, Dict, List, Optional
 from string import Template
 from yaml import safe_load
 
@@ -51,6 +52,8 @@ _skip_addresses: List[str] = []
 _skip_service_names: List[str] = []
 _skip_protocol_muxes: List[str] = []
 _service_name_rewrites: Dict[str, str] = {}
+_service_name_rewrite_templates: Dict[str, Template] = {}  # match -> compiled rewrite, built with the rewrites
+_service_name_rewrite_pattern: Optional[re.Pattern] = None  # any rewrite match, to rule out most names in one scan
 
 PROTOCOL_TCP = Protocol('TCP', 'TCP', True)
 PROTOCOL_SEED = Protocol('SEED', 'Seed', True)
@@ -125,11 +128,16 @@ def _parse_skips(configs: Dict[str, dict]) -> None:
 def _parse_rewrites(configs: Dict[str, dict]) -> None:
     global _service_name_rewrites
     _service_name_rewrites = configs.get('service-name-rewrites') if configs.get('service-name-rewrites') else {}
+    global _service_name_rewrite_templates
+    _service_name_rewrite_templates = {match: Template(rewrite) for match, rewrite in _service_name_rewrites.items()}
+    global _service_name_rewrite_pattern
+    _service_name_rewrite_pattern = re.compile('|'.join(re.escape(match) for match in _service_name_rewrites)) \
+        if _service_name_rewrites else None
 
 
 def skip_address(address: str) -> bool:
     # Check against astrolabe.d/network.yaml
-    if True in [match in address for match in _skip_addresses]:
+    if any(match in address for match in _skip_addresses):
         return True
 
     # Check against default ignored CIDRs
@@ -144,18 +152,16 @@ def skip_address(address: str) -> bool:
 
 
 def skip_service_name(service_name: str) -> bool:
-    return True in [match in service_name for match in _skip_service_names]
+    return any(match in service_name for match in _skip_service_names)
 
 
 def skip_protocol_mux(protocol_mux: str) -> bool:
     # Check again CLI args
-    for skip in constants.ARGS.skip_protocol_muxes:
-        if skip in protocol_mux:
-            return True
+    if any(skip in protocol_mux for skip in constants.ARGS.skip_protocol_muxes):
+        return True
 
     # Check against astrolabe.d/network.yaml
-    matched = [match in protocol_mux for match in _skip_protocol_muxes] or []
-    return True in matched
+    return any(match in protocol_mux for match in _skip_protocol_muxes)
 
 
 def hints(service_name: str) -> List[Hint]:
@@ -180,8 +186,12 @@ def rewrite_service_name(service_name: str, node: node.Node) -> str:
     :param node: used to interpolate attributes into the rewrite
     :return:
     """
-    for match, rewrite in _service_name_rewrites.items():
-        if service_name and match in service_name:
-            return Template(rewrite).substitute(dict(asdict(node)))
+    if not service_name or not _service_name_rewrite_pattern or not _service_name_rewrite_pattern.search(service_name):
+        return service_name
+
+    for match, template in _service_name_rewrite_templates.items():
+        if match in service_name:
+            # vars() rather than asdict(): substitution only needs the top level attributes, not a deep copy
+            return template.substitute(vars(node))
 
     return service_name
@@ -9,7 +9,7 @@ SPDX-License-Identifier: Apache-2.0
 """
 
 from dataclasses import replace
-from typing import Dict
+from typing import Dict, Optional
 
 import coolname
 import faker
@@ -17,6 +17,7 @@ import faker
 from astrolabe.node import NodeTransport
 _obfuscated_service_names: Dict[str, str] = {}
 _obfuscated_protocol_muxes: Dict[str, str] = {}
+_faker: Optional[faker.Generator] = None  # built on first use, creating one loads every faker provider
 
 
 def obfuscate_service_name(service_name: str):
@@ -36,8 +37,15 @@ def _obfuscate_protocol_mux(protocol_mux: str) -> str:
     if protocol_mux in _obfuscated_protocol_muxes:
         return _obfuscated_protocol_muxes[protocol_mux]
     if protocol_mux.isdigit():
-        obfuscated_protocol_mux = str(faker.Factory.create().port_number())
+        obfuscated_protocol_mux = str(_get_faker().port_number())
     else:
         obfuscated_protocol_mux = '#'.join(coolname.generate(2))
     _obfuscated_protocol_muxes[protocol_mux] = obfuscated_protocol_mux
-    return obfuscated_protocol_mux
\ No newline at end of file
+    return obfuscated_protocol_mux
+
+
+def _get_faker() -> faker.Generator:
+    global _faker
+    if _faker is None:
+        _faker = faker.Factory.create()
+    return _faker
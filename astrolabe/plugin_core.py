@@ -93,19 +93,44 @@ class PluginFamilyRegistry:
 
     def parse_plugin_args(self, argparser: configargparse.ArgParser, disabled_classes: Optional[List[str]] = None):
         """Plugins are given an opportunity to register custom CLI arguments"""
-        for plugin in [c for c in self._cls.__subclasses__() if c.ref() not in (disabled_classes or [])]:
+        disabled = frozenset(disabled_classes or ())
+        for plugin in self._cls.__subclasses__():
             plugin: PluginInterface
-            prefix = f'{self._cli_args_prefix}-{plugin.ref()}' if self._cli_args_prefix else plugin.ref()
+            plugin_ref = plugin.ref()
+            if plugin_ref in disabled:
+                continue
+            prefix = f'{self._cli_args_prefix}-{plugin_ref}' if self._cli_args_prefix else plugin_ref
             plugin_argparser = PluginArgParser(prefix, argparser)
             plugin.register_cli_args(plugin_argparser)
 
-    def register_plugins(self, disabled_classes: Optional[List[str]] = None):
-        for plugin in [c for c in self._cls.__subclasses__() if c.ref() not in (disabled_classes or [])]:
-            if plugin.ref() in self._plugin_registry:
-                raise PluginClobberException(f"Provider {plugin.ref()} already registered!")
-            p_obj = plugin()
-            asyncio.get_event_loop().run_until_complete(p_obj.init_async())
-            self._plugin_registry[plugin.ref()] = p_obj
+    def register_plugins(self, disabled_classes: Optional[List[str]] = None, timeout: Optional[float] = None):
+        disabled = frozenset(disabled_classes or ())
+        p_objs: Dict[str, PluginInterface] = {}
+        for plugin in self._cls.__subclasses__():
+            plugin_ref = sys.intern(plugin.ref())  # registry keys are looked up for every node, keep them interned
+            if plugin_ref in disabled:
+                continue
+            if plugin_ref in self._plugin_registry:
+                raise PluginClobberException(f"Provider {plugin_ref} already registered!")
+            p_objs[plugin_ref] = plugin()
+
+        # plugins initialize independently (e.g. provider inventories against different backends), so overlap them
+        #  each is bounded by `timeout` so one hung backend can't stall startup indefinitely
+        results = asyncio.get_event_loop().run_until_complete(
+            asyncio.gather(*[asyncio.wait_for(p_obj.init_async(), timeout=timeout) for p_obj in p_objs.values()],
+                           return_exceptions=True)
+        )
+        for (plugin_ref, p_obj), result in zip(p_objs.items(), results):
+            if not isinstance(result, BaseException):
+                self._plugin_registry[plugin_ref] = p_obj
+                continue
+            if isinstance(result, asyncio.TimeoutError):
+                print(colored(f"Timed out after {timeout}s initializing plugin: {plugin_ref}", 'red'))
+            else:
+                print(colored(f"Failed to initialize plugin: {plugin_ref}: {result!r}", 'red'))
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
 
     def cleanup_plugins(self):
         loop = asyncio.get_event_loop()
@@ -14,9 +14,16 @@ License:
 SPDX-License-Identifier: Apache-2.0
 """
 import asyncio
+import re
+import shlex
 import sys
-from typing import Dict, List, Optional
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
 
+import aiohttp
+import orjson
 from kubernetes_asyncio import client, config
 from kubernetes_asyncio.stream import WsApiClient
 from kubernetes_asyncio.client.rest import ApiException
@@ -26,24 +33,131 @@ from astrolabe import database, constants, logs
 from astrolabe.network import Hint, get_protocol, PROTOCOL_TCP
 from astrolabe.node import NodeTransport, NodeType, Node
 from astrolabe.profile_strategy import ProfileStrategy, INVENTORY_PROFILE_STRATEGY_NAME, HINT_PROFILE_STRATEGY_NAME
-from astrolabe.providers import ProviderInterface, parse_profile_strategy_response
+from astrolabe.providers import ProviderInterface, coalesce_sidecar_dnslookups, parse_profile_strategy_response
 from astrolabe.plugin_core import PluginArgParser
 
-pod_cache: Dict[str, client.models.V1Pod] = {}
+
+class PodSummary(NamedTuple):
+    """The subset of a k8s pod consumed by this provider.  Cached in lieu of a fully deserialized V1Pod"""
+    name: str
+    labels: Dict[str, str]
+    container_names: List[str]
+    exec_container_names: List[str]  # container_names, less those skipped by --k8s-skip-containers
+
+
+class K8sExecException(Exception):
+    """An error running a command over an exec session in a k8s pod container"""
+
+
+class ContainerShell:
+    """
+    A long-lived `sh` exec'd into a single pod container, over which many commands are run one at a time.  This
+    saves the websocket/TLS handshake and process exec that a one-shot exec costs for every command.
+    """
+    STDIN_CHANNEL = 0
+    STDOUT_CHANNEL = 1
+    STDERR_CHANNEL = 2
+    ERROR_CHANNEL = 3
+
+    def __init__(self, ws_api: client.CoreV1Api, pod_name: str, container: str):
+        self.pod_name = pod_name
+        self.container = container
+        self.lock = asyncio.Lock()
+        self._ws_api = ws_api
+        self._ws_context = None
+        self._ws = None
+        self._closed = False
+
+    async def run(self, command: List[str]) -> str:
+        """
+        Run a command in the shell, returning its combined stdout/stderr once it has completed
+
+        :param command: the command to run, in exec form - e.g. ['sh', '-c', 'echo foo']
+        :return: the output of the command
+        """
+        async with self.lock:
+            if self._closed:
+                # closed (evicted) sessions are no longer tracked by the provider, reopening one would leak it
+                raise K8sExecException(f"Exec session closed in {self.pod_name}/{self.container}")
+            if not self._ws:
+                await self._open()
+            sentinel = f"__astrolabe_exec_done_{uuid.uuid4().hex}__"
+            shell_line = f"{shlex.join(command)} < /dev/null 2>&1; printf '\\n%s\\n' {sentinel}\n"
+            try:
+                await self._ws.send_bytes(bytes([self.STDIN_CHANNEL]) + shell_line.encode())
+                return await self._read_until(f"\n{sentinel}\n")
+            except BaseException:
+                # including cancellation (e.g. a discovery timeout): the command may still be running in the shell, and
+                #  its output would be read as that of the next command run in the session
+                await self._close()
+                raise
+
+    async def close(self) -> None:
+        async with self.lock:
+            self._closed = True
+            await self._close()
+
+    async def _open(self) -> None:
+        # IDE inspection doesn't think that this coroutine is async/awaitable, but it is
+        self._ws_context = await self._ws_api.connect_get_namespaced_pod_exec(
+            self.pod_name, constants.ARGS.k8s_namespace, container=self.container, command=['sh'],
+            stderr=True, stdin=True, stdout=True, tty=False, _preload_content=False
+        )
+        self._ws = await self._ws_context.__aenter__()  # pylint:disable=unnecessary-dunder-call
+
+    async def _close(self) -> None:
+        if self._ws_context:
+            await self._ws_context.__aexit__(None, None, None)
+        self._ws_context = None
+        self._ws = None
+
+    async def _read_until(self, terminator: str) -> str:
+        output = ''
+        while terminator not in output:
+            msg = await self._ws.receive()
+            if msg.type not in (aiohttp.WSMsgType.BINARY, aiohttp.WSMsgType.TEXT):
+                raise K8sExecException(f"Exec session closed in {self.pod_name}/{self.container}: {msg.type}")
+            data = msg.data if isinstance(msg.data, bytes) else msg.data.encode()
+            channel, payload = data[0], data[1:].decode(errors='replace')
+            if channel == self.ERROR_CHANNEL and payload:
+                raise K8sExecException(f"Exec session failed in {self.pod_name}/{self.container}: {payload}")
+            if channel in (self.STDOUT_CHANNEL, self.STDERR_CHANNEL):
+                output += payload
+        return output[:output.index(terminator)]
+
+
+pod_cache: Dict[str, PodSummary] = {}
+MISSING_SERVICE_TTL = 60  # seconds a k8s service 404 is remembered for, services may be created mid-scan
 
 
 class ProviderKubernetes(ProviderInterface):
     def __init__(self):
         self.api: client.CoreV1Api
         self.ws_api: client.CoreV1Api
+        self.exec_semaphore: asyncio.Semaphore
+        self.skip_containers_pattern: Optional[re.Pattern]
+        self.exec_sessions: OrderedDict[Tuple[str, str], ContainerShell] = OrderedDict()
+        self.missing_services: Dict[str, float] = {}  # k8s services we have gotten a 404 for, and when
 
     async def init_async(self):
         await config.load_kube_config()
-        self.api = client.CoreV1Api()
-        self.ws_api = client.CoreV1Api(WsApiClient(configuration=client.configuration.Configuration.get_default()))
+        self.exec_semaphore = asyncio.Semaphore(constants.ARGS.k8s_exec_concurrency)
+        self.skip_containers_pattern = _compile_substring_pattern(constants.ARGS.k8s_skip_containers)
+        # one configuration shared by the REST and websocket clients, with a connection pool sized to fit concurrent
+        #  REST calls, and every exec session the websocket client may hold open: up to --k8s-max-exec-sessions idle
+        #  sessions kept for reuse plus --k8s-exec-concurrency sessions running commands
+        configuration = client.Configuration.get_default()
+        configuration.connection_pool_maxsize = max(
+            configuration.connection_pool_maxsize or 0,
+            constants.ARGS.k8s_exec_concurrency * 2,
+            constants.ARGS.k8s_max_exec_sessions + constants.ARGS.k8s_exec_concurrency
+        )
+        self.api = client.CoreV1Api(client.ApiClient(configuration=configuration))
+        self.ws_api = client.CoreV1Api(WsApiClient(configuration=configuration))
         await self._inventory_services()
 
     async def del_async(self):
+        await asyncio.gather(*[shell.close() for shell in self.exec_sessions.values()])
         await self.api.api_client.rest_client.close()
         await self.ws_api.api_client.rest_client.close()
 
@@ -55,7 +169,13 @@ class ProviderKubernetes(ProviderInterface):
     def register_cli_args(argparser: PluginArgParser):
         argparser.add_argument('--skip-containers', nargs='*', default=[], metavar='CONTAINER',
                                help='Ignore containers (uses substring matching)')
+        argparser.add_argument('--exec-concurrency', type=int, default=10, metavar='CONCURRENCY',
+                               help='Max number of concurrent exec (websocket) connections into pod containers')
+        argparser.add_argument('--max-exec-sessions', type=int, default=50, metavar='SESSIONS',
+                               help='Max number of idle exec sessions into pod containers to keep open for reuse')
         argparser.add_argument('--namespace', required=True, help='k8s Namespace in which to discover services')
+        argparser.add_argument('--list-page-size', type=int, default=500, metavar='SIZE',
+                               help='Max number of items to request per page when listing k8s resources')
         argparser.add_argument('--label-selectors', nargs='*', metavar='SELECTOR',
                                help='Additional labels to filter services by in k8s.  '
                                     'Specified in format "LABEL_NAME=VALUE" pairs')
@@ -72,8 +192,8 @@ class ProviderKubernetes(ProviderInterface):
             return
 
         service_name_label = 'app'
-        if service_name_label in pod.metadata.labels:
-            return pod.metadata.labels[service_name_label]
+        if service_name_label in pod.labels:
+            return pod.labels[service_name_label]
 
         return None
 
@@ -83,35 +203,35 @@ class ProviderKubernetes(ProviderInterface):
 
     async def _sidecar_lookup_hostnames(self, address: str) -> None:
         """we are cheating! for every instance we ssh into, we are going to try a name lookup
-           to get the DNS names for anything in the astrolabe DNS Cache that we don't yet have
+           to get the DNS names for anything in the astrolabe DNS Cache that we don't yet have.
+           All pending hostnames are looked up with a single exec per container.
            """
-        asyncio_tasks = []
-        for hostname, node in database.get_nodes_pending_dnslookup():
-            asyncio_tasks.append(self._sidecar_lookup_hostname(address, hostname, node))
-        await asyncio.gather(*asyncio_tasks)
+        pending_nodes = dict(database.get_nodes_pending_dnslookup())
+        if not pending_nodes:
+            return
 
-    async def _sidecar_lookup_hostname(self, address: str, hostname: str, node: Node):
-        sidecar_command = f"getent hosts {hostname} | awk '{{print $1}}'"
-        logs.logger.debug(f"Running sidecar command: {sidecar_command} for address %s", address)
-        exec_command = ['sh', '-c', sidecar_command]
+        async def _lookup(hostnames: List[str]) -> None:
+            await self._sidecar_lookup_hostname(address, {h: pending_nodes[h] for h in hostnames})
+
+        await coalesce_sidecar_dnslookups(list(pending_nodes), _lookup)
+
+    async def _sidecar_lookup_hostname(self, address: str, pending_nodes: Dict[str, Node]) -> None:
         pod = await self._get_pod(address)
         if not pod:
             return
 
-        containers = pod.spec.containers
-        containers = [c for c in containers if True not in
-                      [skip in c.name for skip in constants.ARGS.k8s_skip_containers]]
-        for container in containers:
-            # IDE inspection doesn't think that this coroutine is async/awaitable, but it is
-            ret = await self.ws_api.connect_get_namespaced_pod_exec(address, constants.ARGS.k8s_namespace,
-                                                                    container=container.name, command=exec_command,
-                                                                    stderr=True, stdin=False, stdout=True, tty=False)
-            ip_addrs = ret.strip().split('\n') if ret else None
-            logs.logger.info("Found ipaddrs: [%s] for hostname %s on host %s", ",".join(ip_addrs), hostname, address)
-            for ip_addr in ip_addrs:
-                if ip_addr and database.get_node_by_address(ip_addr) is None:
+        hostnames = ' '.join(shlex.quote(hostname) for hostname in pending_nodes)
+        sidecar_command = f"for h in {hostnames}; do getent hosts \"$h\" | awk -v h=\"$h\" '{{print h, $1}}'; done"
+        logs.logger.debug(f"Running sidecar command: {sidecar_command} for address %s", address)
+        exec_command = ['sh', '-c', sidecar_command]
+
+        for ret in await self._exec_in_containers(address, pod.exec_container_names, exec_command):
+            for hostname, ip_addr in _parse_sidecar_lookup_response(ret):
+                logs.logger.info("Found ipaddr: %s for hostname %s on host %s", ip_addr, hostname, address)
+                if database.get_node_by_address(ip_addr) is None:
                     # TODO: we are glossing over the fact that there can multiple addresses per
                     #  node for DNS records here!  Solve that problem later!
+                    node = pending_nodes[hostname]
                     node.address = ip_addr
                     database.save_node(node)
 
@@ -134,19 +254,28 @@ class ProviderKubernetes(ProviderInterface):
 
     async def _profile_k8s_service(self, address: str) -> List[NodeTransport]:
         # k8s_service_pfs = profile_strategy.
+        if time.monotonic() - self.missing_services.get(address, float('-inf')) < MISSING_SERVICE_TTL:
+            logs.logger.debug("Skipping profile of k8s service %s, previously not found", address)
+            return []
+
         try:
-            service = await self.api.read_namespaced_service(address, namespace="default")
+            service = await self.api.read_namespaced_service(address, namespace=constants.ARGS.k8s_namespace)
             selector = service.spec.selector
             if not selector:
                 return []
 
             label_selector = ",".join([f"{key}={value}" for key, value in selector.items()])
-            pods = await self.api.list_namespaced_pod(namespace="default", label_selector=label_selector)
+            # only pod names are needed here - skip deserializing full V1Pod models for every pod in the service.
+            #  resource_version="0" lets the apiserver serve the list from its watch cache rather than etcd
+            response = await self.api.list_namespaced_pod(namespace=constants.ARGS.k8s_namespace,
+                                                          label_selector=label_selector, resource_version="0",
+                                                          _preload_content=False)
+            pods = await _read_json(response)
 
             node_transports = []
-            for pod in pods.items:
+            for pod in pods['items']:
                 node_transport = NodeTransport(
-                    address=pod.metadata.name,
+                    address=pod['metadata']['name'],
                     protocol=get_protocol('TCP'),
                     protocol_mux=service.spec.ports[0].target_port,
                     profile_strategy_name='_profile_k8s_service',
@@ -154,36 +283,70 @@ class ProviderKubernetes(ProviderInterface):
                     from_hint=False
                 )
                 node_transports.append(node_transport)
-                logs.logger.debug("Found %d profile results for %s, profile strategy: \"%s\"..",
-                                  len(node_transports), address, '_profile_k8s_service')
+            logs.logger.debug("Found %d profile results for %s, profile strategy: \"%s\"..",
+                              len(node_transports), address, '_profile_k8s_service')
             return node_transports
 
         except ApiException as exc:
-            print(f"Exception when calling CoreV1Api: {exc}")
+            logs.logger.debug("Cannot profile k8s service %s w/ ApiException(%s:%s)", address, exc.status, exc.reason)
+            if exc.status == 404:
+                self.missing_services[address] = time.monotonic()
             return []
 
     async def _profile_pod(self, address: str, pfss: List[ProfileStrategy]) -> List[NodeTransport]:
+        pod = await self._get_pod(address)
+        if not pod:
+            return []
+
         node_transports = []
         for pfs in pfss:
             shell_command = pfs.provider_args['shell_command']
             exec_command = ['bash', '-c', shell_command]
-            pod = await self._get_pod(address)
-            if not pod:
-                return []
-
-            containers = pod.spec.containers
-            containers = [c for c in containers if True not in
-                          [skip in c.name for skip in constants.ARGS.k8s_skip_containers]]
-
-            for container in containers:
-                ret = await self.ws_api.connect_get_namespaced_pod_exec(address, constants.ARGS.k8s_namespace,
-                                                                        container=container.name, command=exec_command,
-                                                                        stderr=True, stdin=False, stdout=True,
-                                                                        tty=False)
+            for ret in await self._exec_in_containers(address, pod.exec_container_names, exec_command):
                 node_transport = parse_profile_strategy_response(ret, address, pfs)
                 node_transports.extend(node_transport)
         return node_transports
 
+    def _filter_containers(self, container_names: List[str]) -> List[str]:
+        """Filter out containers matching any of --k8s-skip-containers (substring match)"""
+        if not self.skip_containers_pattern:
+            return container_names
+        return [c for c in container_names if not self.skip_containers_pattern.search(c)]
+
+    async def _exec_in_containers(self, address: str, containers: List[str], exec_command: List[str]) -> List[str]:
+        """
+        Exec a command in each of the containers of a pod concurrently, bounded by --k8s-exec-concurrency.  Commands
+        are run over exec sessions which are kept open and reused across calls for the same container.
+
+        :param address: the pod name
+        :param containers: container names to exec into
+        :param exec_command: the command to exec
+        :return: the output of the command per container, in the same order as `containers`
+        """
+        async def _exec(container: str) -> str:
+            async with self.exec_semaphore:
+                return await (await self._get_exec_session(address, container)).run(exec_command)
+
+        return await asyncio.gather(*[_exec(container) for container in containers])
+
+    async def _get_exec_session(self, address: str, container: str) -> ContainerShell:
+        """Get the (least recently used ordered) exec session for a container, closing idle sessions beyond
+        --k8s-max-exec-sessions"""
+        key = (address, container)
+        if key not in self.exec_sessions:
+            # idle sessions are picked and popped before anything is awaited, so concurrent calls never pick the same
+            #  session twice
+            overflow = len(self.exec_sessions) + 1 - constants.ARGS.k8s_max_exec_sessions
+            idle_keys = [k for k, shell in self.exec_sessions.items() if not shell.lock.locked()][:max(0, overflow)]
+            evicted = [self.exec_sessions.pop(idle_key, None) for idle_key in idle_keys]
+            await asyncio.gather(*[shell.close() for shell in evicted if shell])
+            # added only once nothing more is awaited before the caller's run() locks it, so no concurrent call can
+            #  pick the new session as idle
+            if key not in self.exec_sessions:
+                self.exec_sessions[key] = ContainerShell(self.ws_api, address, container)
+        self.exec_sessions.move_to_end(key)
+        return self.exec_sessions[key]
+
     async def take_a_hint(self, hint: Hint) -> List[NodeTransport]:
         ret = await self.api.list_namespaced_pod(constants.ARGS.k8s_namespace, limit=1,
                                                  label_selector=_parse_label_selector(hint.service_name))
@@ -204,9 +367,10 @@ class ProviderKubernetes(ProviderInterface):
             debug_identifier=hint.service_name
         )]
 
-    async def _get_pod(self, pod_name: str) -> Optional[client.models.V1Pod]:
+    async def _get_pod(self, pod_name: str) -> Optional[PodSummary]:
         """
-        Get the pod from kubernetes API, with caching
+        Get the pod from kubernetes API, with caching.  The raw API response is parsed for only the fields we
+        consume, rather than deserializing (and caching) the entire V1Pod model.
 
         :param pod_name:
         :return:
@@ -215,7 +379,16 @@ class ProviderKubernetes(ProviderInterface):
             return pod_cache[pod_name]
 
         try:
-            pod = await self.api.read_namespaced_pod(pod_name, constants.ARGS.k8s_namespace)
+            response = await self.api.read_namespaced_pod(pod_name, constants.ARGS.k8s_namespace,
+                                                          _preload_content=False)
+            raw_pod = await _read_json(response)
+            container_names = [c['name'] for c in raw_pod['spec']['containers']]
+            pod = PodSummary(
+                name=raw_pod['metadata']['name'],
+                labels=raw_pod['metadata'].get('labels') or {},
+                container_names=container_names,
+                exec_container_names=self._filter_containers(container_names)
+            )
             pod_cache[pod_name] = pod
         except ApiException as exc:
             logs.logger.debug("Cannot find pod %s w/ ApiException(%s:%s)", pod_name, exc.status, exc.reason)
@@ -227,21 +400,20 @@ class ProviderKubernetes(ProviderInterface):
         """
         Inventory all services in the cluster and cache their DNS names and service names.
         """
-        services = await self.api.list_service_for_all_namespaces(watch=False)
-        for svc in services.items:
-            if svc.spec.type == "LoadBalancer" and svc.status.load_balancer.ingress:
-                ports = svc.spec.ports[0]
-                ingress = svc.status.load_balancer.ingress
-                lb_address = ingress[0].hostname or ingress[0].ip
-                lb_name = svc.metadata.name
-                k8s_service_address = svc.metadata.name
-                k8s_service_name = f"{svc.metadata.name}-service"
+        async for svc in self._list_services():
+            ingress = svc.get('status', {}).get('loadBalancer', {}).get('ingress')
+            if svc['spec'].get('type') == "LoadBalancer" and ingress:
+                ports = svc['spec']['ports'][0]
+                lb_address = ingress[0].get('hostname') or ingress[0].get('ip')
+                lb_name = svc['metadata']['name']
+                k8s_service_address = svc['metadata']['name']
+                k8s_service_name = f"{svc['metadata']['name']}-service"
                 k8s_service_node = Node(
                     address=k8s_service_address,
                     node_type=NodeType.DEPLOYMENT,
                     profile_strategy_name=INVENTORY_PROFILE_STRATEGY_NAME,
                     protocol=PROTOCOL_TCP,
-                    protocol_mux=ports.node_port,
+                    protocol_mux=ports.get('nodePort'),
                     provider='k8s',
                     service_name=k8s_service_name
                 )
@@ -250,7 +422,7 @@ class ProviderKubernetes(ProviderInterface):
                     profile_strategy_name=INVENTORY_PROFILE_STRATEGY_NAME,
                     provider='k8s',
                     protocol=PROTOCOL_TCP,
-                    protocol_mux=ports.port,
+                    protocol_mux=ports.get('port'),
                     service_name=lb_name,
                     aliases=[lb_address]
                 )
@@ -260,15 +432,66 @@ class ProviderKubernetes(ProviderInterface):
                 logs.logger.info("Inventoried 1 k8s service node: %s", k8s_service_node.debug_id())
                 logs.logger.info("Inventoried 1 k8s load balancer node: %s", lb_node.debug_id())
 
+    async def _list_services(self) -> AsyncIterator[dict]:
+        """
+        List all services in the cluster, paging through the results --k8s-list-page-size at a time rather than
+        having the apiserver build (and us parse) one unbounded response.  Services are yielded as raw (camelCase)
+        API dicts, skipping V1Service model deserialization.
+        """
+        list_kwargs = {'watch': False, 'limit': constants.ARGS.k8s_list_page_size, '_preload_content': False}
+        while True:
+            response = await self.api.list_service_for_all_namespaces(**list_kwargs)
+            services = await _read_json(response)
+            for svc in services['items']:
+                yield svc
+            continue_token = services['metadata'].get('continue')
+            if not continue_token:
+                return
+            list_kwargs['_continue'] = continue_token
+
+
+async def _read_json(response) -> dict:
+    """Parse the body of a raw k8s API response, as returned when calling the API with `_preload_content=False`.
+    The api client does not raise for error statuses on raw responses, so we do that here.
+    """
+    body = await response.read()
+    if not 200 <= response.status <= 299:
+        raise ApiException(status=response.status, reason=response.reason)
+    return orjson.loads(body)
+
+
+def _parse_sidecar_lookup_response(response: str) -> List[Tuple[str, str]]:
+    """Parse "hostname ipaddr" lines as output by the sidecar lookup command
+
+    :param response: raw output of the sidecar lookup command
+    :return: a list of (hostname, ipaddr) pairs
+    """
+    pairs = []
+    for line in (response or '').splitlines():
+        cols = line.split()
+        if len(cols) == 2:
+            pairs.append((cols[0], cols[1]))
+    return pairs
+
+
+def _compile_substring_pattern(substrings: List[str]) -> Optional[re.Pattern]:
+    """Compile a list of substrings into a single alternation regex, so that matching a string against all of them
+    is one scan rather than one scan per substring
+
+    :param substrings: literal substrings to match
+    :return: the compiled pattern, or None if there are no substrings to match
+    """
+    if not substrings:
+        return None
+    return re.compile('|'.join(re.escape(substring) for substring in substrings))
+
 
 def _parse_label_selector(service_name: str) -> str:
     """Generate a label selector to pass to the k8s api from service name and CLI args
     :param service_name: the service name
     """
-    label_name_pos = 0
-    label_value_pos = 1
     label_selector_pairs = {constants.ARGS.k8s_service_name_label: service_name}
-    for label, value in [(selector.split('=')[label_name_pos], selector.split('=')[label_value_pos])
-                         for selector in constants.ARGS.k8s_label_selectors]:
+    for selector in constants.ARGS.k8s_label_selectors or []:
+        label, value = selector.split('=', 1)
         label_selector_pairs[label] = value
     return ','.join(f"{label}={value}" for label, value in label_selector_pairs.items())
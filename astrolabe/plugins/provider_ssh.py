@@ -13,10 +13,13 @@ SPDX-License-Identifier: Apache-2.0
 """
 
 import asyncio
+import contextlib
 import os
 import getpass
 import sys
-from typing import List, Optional
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
 
 import asyncssh
 import paramiko
@@ -25,16 +28,26 @@ from termcolor import colored
 
 from astrolabe import database, constants, logs
 from astrolabe.profile_strategy import ProfileStrategy
-from astrolabe.providers import ProviderInterface, TimeoutException, parse_profile_strategy_response
+from astrolabe.providers import (ProviderInterface, TimeoutException, coalesce_sidecar_dnslookups,
+                                 parse_profile_strategy_response)
 from astrolabe.plugin_core import PluginArgParser
 from astrolabe.node import Node, NodeTransport
 
 bastion: Optional[SSHClientConnection] = None
 CONNECT_TIMEOUT = 5
+CONNECT_RETRIES = 3
+CONNECT_RETRY_BACKOFF = .1
 CONNECTION_SEMAPHORE = None
 CONNECTION_SEMAPHORE_SPACES_USED = 0
+CONNECTION_SEMAPHORE_SPACES_TO_RETIRE = 0  # spaces to take out of the semaphore as they are next released
 CONNECTION_SEMAPHORE_SPACES_MIN = 10
 SSH_CONNECT_ARGS = None
+SSH_CONFIGURE_LOCK = asyncio.Lock()
+SSH_CONFIG: Optional[paramiko.SSHConfig] = None
+CONNECTION_POOL: OrderedDict[str, SSHClientConnection] = OrderedDict()
+CONNECTION_POOL_LAST_USED: Dict[str, float] = {}
+CONNECTION_POOL_PINS: Dict[str, int] = {}  # number of sidecar lookups running on a host's pooled connection
+CONNECTION_POOL_OPENING: Dict[str, asyncio.Future] = {}  # in flight opens, by host
 
 
 class ProviderSSH(ProviderInterface):
@@ -51,23 +64,46 @@ class ProviderSSH(ProviderInterface):
         argparser.add_argument('--config-file', default="~/.ssh/config", metavar='FILE',
                                help='SSH config file to parse for configuring SSH sessions.  '
                                     'As in `ssh -F ~/.ssh/config`)')
+        argparser.add_argument('--max-pooled-connections', type=int, default=50, metavar='CONNECTIONS',
+                               help='Max number of idle SSH connections to keep open for reuse')
         argparser.add_argument('--passphrase', action='store_true',
                                help='Prompt for, and use the specified passphrase to decrype SSH private keys')
         argparser.add_argument('--name-command', required=True, metavar='COMMAND',
                                help='Used by SSH Provider to determine node name')
 
+    async def del_async(self):
+        for conn in CONNECTION_POOL.values():
+            conn.close()
+        await asyncio.gather(*[conn.wait_closed() for conn in CONNECTION_POOL.values()])
+        CONNECTION_POOL.clear()
+        CONNECTION_POOL_LAST_USED.clear()
+
     async def open_connection(self, address: str) -> SSHClientConnection:
         await _configure_connection_semaphore()
         if not SSH_CONNECT_ARGS:
-            await _configure(address)
-        logs.logger.debug("Getting asyncio SSH connection for host %s", address)
-        async with CONNECTION_SEMAPHORE:
-            return await _get_connection(address)
+            # the first open configures ssh, concurrent opens wait for it rather than connecting unconfigured
+            async with SSH_CONFIGURE_LOCK:
+                if not SSH_CONNECT_ARGS:
+                    await _configure(address)
+        if address in CONNECTION_POOL:
+            logs.logger.debug("Reusing pooled SSH connection for host %s", address)
+            CONNECTION_POOL.move_to_end(address)
+            CONNECTION_POOL_LAST_USED[address] = time.monotonic()
+            return CONNECTION_POOL[address]
+        # concurrent opens for the same host are coalesced into a single connection
+        if address not in CONNECTION_POOL_OPENING:
+            opening = asyncio.ensure_future(_open_pooled_connection(address))
+            CONNECTION_POOL_OPENING[address] = opening
+            opening.add_done_callback(lambda _: CONNECTION_POOL_OPENING.pop(address, None))
+        # shielded, so one caller timing out doesn't cancel the open for the others
+        connection = await asyncio.shield(CONNECTION_POOL_OPENING[address])
+        CONNECTION_POOL_LAST_USED[address] = time.monotonic()
+        return connection
 
     async def lookup_name(self, address: str, connection: SSHClientConnection) -> str:
         logs.logger.debug("Getting service name for address %s", address)
         node_name_command = constants.ARGS.ssh_name_command
-        async with CONNECTION_SEMAPHORE:
+        async with _connection_semaphore_space():
             result = await connection.run(node_name_command, check=True)
         node_name = result.stdout.strip()
         logs.logger.debug("Discovered name: %s for address %s", node_name, address)
@@ -102,55 +138,125 @@ async def _get_connection(host: str, retry_num=0) -> asyncssh.SSHClientConnectio
     try:
         if bastion:
             logs.logger.debug("Using bastion: %s", str(bastion))
-            conn = await bastion.connect_ssh(host, **SSH_CONNECT_ARGS)
-        conn = await asyncssh.connect(host, **SSH_CONNECT_ARGS)
-        return conn
+            return await bastion.connect_ssh(host, **SSH_CONNECT_ARGS)
+        return await asyncssh.connect(host, **SSH_CONNECT_ARGS)
     except ChannelOpenError as exc:
         raise TimeoutException(f"asyncssh.ChannelOpenError encountered opening SSH connection for {host}") from exc
     except Exception as exc:
-        if retry_num < 3:
-            asyncio.ensure_future(_occupy_one_sempahore_space())
-            await asyncio.sleep(.1)
+        if retry_num < CONNECT_RETRIES:
+            _shrink_connection_semaphore()
+            await asyncio.sleep(CONNECT_RETRY_BACKOFF * 2 ** retry_num)
             return await _get_connection(host, retry_num + 1)
         raise exc
 
 
-async def _occupy_one_sempahore_space() -> None:
-    """Use up one spot in the SSH connection semaphore.
+async def _open_pooled_connection(address: str) -> SSHClientConnection:
+    logs.logger.debug("Getting asyncio SSH connection for host %s", address)
+    async with _connection_semaphore_space():
+        connection = await _get_connection(address)
+    _pool_connection(address, connection)
+    return connection
+
 
-       This is used to fine tune whether the semaphore is configured
-       for too many concurrent SHH connection.  It will not occupy more
-       than that which leaves {semaphore_spaces_min} spaces in the
-       semaphore for real work.
+def _pool_connection(address: str, connection: SSHClientConnection) -> None:
+    """Pool a connection (least recently used ordered) for reuse.  A connection is dropped from the pool once it
+       closes so that a dead connection is never handed out, and idle connections beyond
+       --ssh-max-pooled-connections are closed.  A connection is only used for the sidecar, name lookup and profile
+       of the node it was handed out for, each bounded by --timeout, so it is idle once those have all timed out and
+       no sidecar lookup (which may outlive its node's timeout) is pinning it.
     """
-    global CONNECTION_SEMAPHORE_SPACES_USED
+    CONNECTION_POOL[address] = connection
+    CONNECTION_POOL_LAST_USED[address] = time.monotonic()
+
+    def _evict_closed(_):
+        if CONNECTION_POOL.get(address) is connection:
+            _unpool_connection(address)
+    asyncio.ensure_future(connection.wait_closed()).add_done_callback(_evict_closed)
+
+    idle_since = time.monotonic() - 3 * constants.ARGS.timeout
+    idle_addresses = [a for a in CONNECTION_POOL if a != address and not CONNECTION_POOL_PINS.get(a)
+                      and CONNECTION_POOL_LAST_USED.get(a, 0) < idle_since]
+    for idle_address in idle_addresses[:max(0, len(CONNECTION_POOL) - constants.ARGS.ssh_max_pooled_connections)]:
+        logs.logger.debug("Closing idle pooled SSH connection for host %s", idle_address)
+        _unpool_connection(idle_address).close()
+
+
+def _unpool_connection(address: str) -> SSHClientConnection:
+    """Drop a host's connection from the pool, along with its bookkeeping"""
+    CONNECTION_POOL_LAST_USED.pop(address, None)
+    return CONNECTION_POOL.pop(address)
+
+
+@contextlib.contextmanager
+def _pin_pooled_connection(address: str):
+    """Keep a host's pooled connection from being closed as idle while in use"""
+    CONNECTION_POOL_PINS[address] = CONNECTION_POOL_PINS.get(address, 0) + 1
+    try:
+        yield
+    finally:
+        CONNECTION_POOL_PINS[address] -= 1
+        if not CONNECTION_POOL_PINS[address]:
+            del CONNECTION_POOL_PINS[address]
+        if address in CONNECTION_POOL:
+            CONNECTION_POOL_LAST_USED[address] = time.monotonic()
+
+
+def _shrink_connection_semaphore() -> None:
+    """Take one space out of the SSH connection semaphore for the rest of the run.
+
+       Failed connections are taken as a sign that the semaphore is configured
+       for too many concurrent SSH connections.  It will not shrink the semaphore
+       below {semaphore_spaces_min} spaces for real work.  The space is taken
+       the next time one is released, by not releasing it, so no task is left
+       parked waiting to acquire it.
+    """
+    global CONNECTION_SEMAPHORE_SPACES_USED, CONNECTION_SEMAPHORE_SPACES_TO_RETIRE
 
     if (constants.ARGS.ssh_concurrency - CONNECTION_SEMAPHORE_SPACES_USED) > CONNECTION_SEMAPHORE_SPACES_MIN:
-        async with CONNECTION_SEMAPHORE:
-            CONNECTION_SEMAPHORE_SPACES_USED += 1
-            logs.logger.debug("Using 1 additional semaphore space, (%d used)", CONNECTION_SEMAPHORE_SPACES_USED)
-            forever_in_the_context_of_this_program = 86400
-            await asyncio.sleep(forever_in_the_context_of_this_program)
+        CONNECTION_SEMAPHORE_SPACES_USED += 1
+        CONNECTION_SEMAPHORE_SPACES_TO_RETIRE += 1
+        logs.logger.debug("Using 1 additional semaphore space, (%d used)", CONNECTION_SEMAPHORE_SPACES_USED)
+
+
+@contextlib.asynccontextmanager
+async def _connection_semaphore_space():
+    """Hold a space in the SSH connection semaphore, retiring it on release if the semaphore is shrinking"""
+    global CONNECTION_SEMAPHORE_SPACES_TO_RETIRE
+
+    await CONNECTION_SEMAPHORE.acquire()
+    try:
+        yield
+    finally:
+        if CONNECTION_SEMAPHORE_SPACES_TO_RETIRE:
+            CONNECTION_SEMAPHORE_SPACES_TO_RETIRE -= 1
+        else:
+            CONNECTION_SEMAPHORE.release()
 
 
 # configuration private functions
 async def _configure(address: str):
     global bastion, SSH_CONNECT_ARGS
-    # SSH CONNECT ARGS
-    SSH_CONNECT_ARGS = {'known_hosts': None}
+    # SSH CONNECT ARGS - built up locally, and only published once complete (bastion included)
+    ssh_connect_args = {'known_hosts': None}
+    # parsing the ssh config file is blocking file i/o, keep it off of the event loop
+    await asyncio.to_thread(_get_ssh_config)
     ssh_config = _get_ssh_config_for_host(address)
-    SSH_CONNECT_ARGS['username'] = ssh_config.get('user')
+    ssh_connect_args['username'] = ssh_config.get('user')
     if constants.ARGS.ssh_passphrase:
-        SSH_CONNECT_ARGS['passphrase'] = getpass.getpass(colored("Enter SSH key passphrase:", 'green'))
+        ssh_connect_args['passphrase'] = getpass.getpass(colored("Enter SSH key passphrase:", 'green'))
 
     # BASTION
     bastion_address = _get_jump_server_for_host(ssh_config)
-    if not bastion_address:
-        return
+    if bastion_address:
+        bastion = await _connect_bastion(bastion_address, address, ssh_connect_args)
+
+    SSH_CONNECT_ARGS = ssh_connect_args
+
 
+async def _connect_bastion(bastion_address: str, address: str, ssh_connect_args: dict) -> SSHClientConnection:
     try:
-        bastion = await asyncio.wait_for(
-            asyncssh.connect(bastion_address, **SSH_CONNECT_ARGS), timeout=constants.ARGS.ssh_bastion_timeout
+        return await asyncio.wait_for(
+            asyncssh.connect(bastion_address, **ssh_connect_args), timeout=constants.ARGS.ssh_bastion_timeout
         )
     except asyncio.TimeoutError:
         print(colored(f"Timeout connecting to SSH bastion server: {bastion_address}.  "
@@ -166,7 +272,8 @@ async def _configure(address: str):
 
 async def _configure_connection_semaphore():
     global CONNECTION_SEMAPHORE
-    CONNECTION_SEMAPHORE = asyncio.BoundedSemaphore(constants.ARGS.ssh_concurrency)
+    if CONNECTION_SEMAPHORE is None:
+        CONNECTION_SEMAPHORE = asyncio.BoundedSemaphore(constants.ARGS.ssh_concurrency)
 
 
 def _get_ssh_config_for_host(host: str) -> dict:
@@ -184,6 +291,15 @@ def _get_ssh_config_for_host(host: str) -> dict:
             'userknownhostsfile': '/dev/null'
         }
     """
+    return _get_ssh_config().lookup(host)
+
+
+def _get_ssh_config() -> paramiko.SSHConfig:
+    """Parse the ssh config file once, returning the cached parse on subsequent calls"""
+    global SSH_CONFIG
+    if SSH_CONFIG:
+        return SSH_CONFIG
+
     ssh_config = paramiko.SSHConfig()
     user_config_file = os.path.expanduser(constants.ARGS.ssh_config_file)
     try:
@@ -193,7 +309,8 @@ def _get_ssh_config_for_host(host: str) -> dict:
         print("%s file could not be found. Aborting.", user_config_file)
         sys.exit(1)
 
-    return ssh_config.lookup(host)
+    SSH_CONFIG = ssh_config
+    return SSH_CONFIG
 
 
 def _get_jump_server_for_host(config: dict) -> Optional[str]:
@@ -242,10 +359,15 @@ async def _sidecar_lookup_hostnames(address: str, connection: SSHClientConnectio
     """we are cheating! for every instance we ssh into, we are going to try a name lookup
        to get the DNS names for anything in the astrolabe DNS Cache that we don't yet have
        """
-    asyncio_tasks = []
-    for hostname, node in database.get_nodes_pending_dnslookup():
-        asyncio_tasks.append(_sidecar_lookup_hostname(address, hostname, node, connection))
-    await asyncio.gather(*asyncio_tasks)
+    pending_nodes = dict(database.get_nodes_pending_dnslookup())
+
+    async def _lookup(hostnames: List[str]) -> None:
+        # a shared lookup can outlive this node's timeouts, its connection must stay open until the lookup is done
+        with _pin_pooled_connection(address):
+            await asyncio.gather(*[_sidecar_lookup_hostname(address, hostname, pending_nodes[hostname], connection)
+                                   for hostname in hostnames])
+
+    await coalesce_sidecar_dnslookups(list(pending_nodes), _lookup)
 
 
 async def _sidecar_lookup_hostname(address: str, hostname: str, node: Node, connection: SSHClientConnection) -> None:
@@ -254,7 +376,7 @@ async def _sidecar_lookup_hostname(address: str, hostname: str, node: Node, conn
        """
     sidecar_command = f"getent hosts {hostname} | awk '{{print $1}}'"
     logs.logger.debug("Looking up ipaddresses for hostname %s on host %s", hostname, address)
-    async with CONNECTION_SEMAPHORE:
+    async with _connection_semaphore_space():
         result = await connection.run(sidecar_command, check=True)
     if not result:
         logs.logger.info("No ipaddres found for hostname %s on host %s", hostname, address)
@@ -9,11 +9,16 @@ License:
 SPDX-License-Identifier: Apache-2.0
 """
 
+import hashlib
+import marshal
+import os
 import typing
 import re
-from dataclasses import dataclass
-from typing import List, Optional
-from yaml import safe_load_all
+import sys
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import yaml
 
 from astrolabe import config, constants, logs, network
 
@@ -22,7 +27,31 @@ class ProfileStrategyException(Exception):
     """Exceptions for ProfileStrategy"""
 
 
-@dataclass(frozen=True)
+class _MatchAll(NamedTuple):
+    provider: str
+
+
+class _MatchAddress(NamedTuple):
+    pattern: Optional[re.Pattern]  # all of the matches folded into one regex, None when they can't be combined
+    providers: Dict[str, str]  # combined pattern group name -> provider
+    matches: List[Tuple[re.Pattern, str]]  # compiled (pattern, provider) pairs, in configured order
+    default: Optional[str]
+
+
+class _MatchPort(NamedTuple):
+    matches: Dict[int, str]  # keys normalized to int, yaml may give us either `80:` or `"80":`
+    default: Optional[str]
+
+
+# child provider matcher type -> ProfileStrategy method implementing it
+_CHILD_PROVIDER_MATCHERS = {
+    _MatchAll: '_match_all',
+    _MatchAddress: '_match_address',
+    _MatchPort: '_match_port'
+}
+
+
+@dataclass(frozen=True, slots=True)
 class ProfileStrategy:  # pylint:disable=too-many-instance-attributes
     description: str
     name: str
@@ -32,6 +61,23 @@ class ProfileStrategy:  # pylint:disable=too-many-instance-attributes
     child_provider: dict
     service_name_filter: dict
     __type__: str = 'ProfileStrategy'  # for json serialization/deserialization
+    # child_provider compiled into a typed matcher once rather than re-read from the dict on every call
+    _matcher: Optional[tuple] = field(default=None, init=False, repr=False, compare=False)
+    # service_name_filter lists as frozensets for constant time membership checks
+    _not_filters: Optional[frozenset] = field(default=None, init=False, repr=False, compare=False)
+    _only_filters: Optional[frozenset] = field(default=None, init=False, repr=False, compare=False)
+    # bound _match_* method for the matcher type, picked once instead of string comparing on every call
+    _dispatch: Callable[[str, str], Optional[str]] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        matcher = _compile_child_provider(self.name, self.child_provider)
+        object.__setattr__(self, '_matcher', matcher)
+        not_filters = self.service_name_filter.get('not') if self.service_name_filter else None
+        only_filters = self.service_name_filter.get('only') if self.service_name_filter else None
+        object.__setattr__(self, '_not_filters', frozenset(not_filters) if not_filters else None)
+        object.__setattr__(self, '_only_filters', frozenset(only_filters) if only_filters else None)
+        method = _CHILD_PROVIDER_MATCHERS.get(type(matcher), '_match_unsupported')
+        object.__setattr__(self, '_dispatch', getattr(self, method))
 
     def filter_service_name(self, service_name: str) -> bool:
         """
@@ -40,14 +86,9 @@ class ProfileStrategy:  # pylint:disable=too-many-instance-attributes
         :param service_name:
         :return:
         """
-        if not self.service_name_filter:
-            return False
-
-        not_filters = self.service_name_filter.get('not')
-        only_filters = self.service_name_filter.get('only')
-        if not_filters and service_name in not_filters:
+        if self._not_filters and service_name in self._not_filters:
             return True
-        if only_filters and service_name not in only_filters:
+        if self._only_filters and service_name not in self._only_filters:
             return True
 
         return False
@@ -60,32 +101,99 @@ class ProfileStrategy:  # pylint:disable=too-many-instance-attributes
         :param address: address of the node
         :return: a string representation of the provider
         """
-        if 'matchAll' == self.child_provider['type']:
-            return self.child_provider['provider']
+        return self._dispatch(protocol_mux, address)
 
-        if 'matchAddress' == self.child_provider['type']:
-            for match, provider in self.child_provider['matches'].items():
-                if re.search(match, address or ''):
-                    return provider
-            return self.child_provider['default']
+    def _match_all(self, protocol_mux: str, address: str) -> Optional[str]:  # pylint:disable=unused-argument
+        return self._matcher.provider
 
-        if 'matchPort' == self.child_provider['type']:
-            try:
-                if int(protocol_mux) in self.child_provider['matches']:
-                    return self.child_provider['matches'][int(protocol_mux)]
-                return self.child_provider['default']
-            except (ValueError, IndexError):
-                return self.child_provider['default']
+    def _match_address(self, protocol_mux: str, address: str) -> Optional[str]:  # pylint:disable=unused-argument
+        matcher = self._matcher
+        if matcher.pattern:
+            match = matcher.pattern.match(address or '')
+            return matcher.providers[match.lastgroup] if match else matcher.default
+        for pattern, provider in matcher.matches:
+            if pattern.search(address or ''):
+                return provider
+        return matcher.default
+
+    def _match_port(self, protocol_mux: str, address: str) -> Optional[str]:  # pylint:disable=unused-argument
+        try:
+            port = int(protocol_mux)
+        except (ValueError, TypeError):
+            return self._matcher.default
+        return self._matcher.matches.get(port, self._matcher.default)
 
-        logs.logger.fatal("child provider match type: %s not supported", self.child_provider['type'])
+    def _match_unsupported(self, protocol_mux: str, address: str) -> Optional[str]:  # pylint:disable=unused-argument
+        logs.logger.fatal("child provider match type: %s not supported", self.child_provider.get('type'))
         raise ProfileStrategyException()
 
 
+def _compile_child_provider(name: str, child_provider: dict) -> Optional[tuple]:
+    """
+    Compile the childProvider config into its typed matcher
+
+    :param name: name of the ProfileStrategy, for logging
+    :param child_provider: the childProvider config from yaml
+    :return: a _MatchAll, _MatchAddress or _MatchPort - None if the type is not supported
+    """
+    child_provider_type = child_provider.get('type') if child_provider else None
+    if 'matchAll' == child_provider_type:
+        return _MatchAll(child_provider.get('provider'))
+    if 'matchAddress' == child_provider_type:
+        address_matches = [(re.compile(match), provider) for match, provider in child_provider['matches'].items()]
+        pattern, providers = _combine_address_matches(address_matches)
+        return _MatchAddress(pattern, providers, address_matches, child_provider.get('default'))
+    if 'matchPort' == child_provider_type:
+        port_matches = {}
+        for port, provider in child_provider['matches'].items():
+            try:
+                port_matches[int(port)] = provider
+            except (ValueError, TypeError):
+                # a non-numeric port could never match a port protocol_mux, so skip it rather than fail the load
+                logs.logger.warning("ProfileStrategy %s: ignoring non-numeric matchPort key: %s", name, port)
+        return _MatchPort(port_matches, child_provider.get('default'))
+    return None
+
+
+def _combine_address_matches(address_matches: List[Tuple[re.Pattern, str]]) \
+        -> Tuple[Optional[re.Pattern], Dict[str, str]]:
+    """
+    Fold the matchAddress regexes into one alternation so an address is scanned by a single regex call.  Each
+    alternative is prefixed with a lazy `.*?` and the result is used with match(), so the alternatives are tried in
+    order at position 0 and the first listed pattern matching anywhere in the address wins, same as searching them
+    one at a time.  Patterns carrying their own groups or inline flags can't be safely combined; for those (None, {})
+    is returned and the caller searches the patterns individually.
+
+    :param address_matches: compiled (pattern, provider) pairs in the order they were configured
+    :return: the combined pattern and a map of its group names to providers
+    """
+    default_flags = re.compile('').flags
+    if not address_matches or any(pattern.groups or pattern.flags != default_flags for pattern, _ in address_matches):
+        return None, {}
+    try:
+        combined = re.compile('|'.join(f"(?P<_m{i}>(?s:.)*?(?:{pattern.pattern}))"
+                                       for i, (pattern, _) in enumerate(address_matches)))
+    except re.error:
+        return None, {}
+    return combined, {f"_m{i}": provider for i, (_, provider) in enumerate(address_matches)}
+
+
 profile_strategies: typing.List[ProfileStrategy] = []
+# profile_strategies indexed by each of their providers, so discovery doesn't walk every strategy for every node
+_profile_strategies_by_provider: Dict[str, List[ProfileStrategy]] = {}
 _seed_profile_strategy_child_provider = {'type': 'matchAll', 'provider': constants.PROVIDER_SSH}
 SEED_PROFILE_STRATEGY_NAME = 'Seed'
 INVENTORY_PROFILE_STRATEGY_NAME = 'Inventory'
 HINT_PROFILE_STRATEGY_NAME = 'Hint'
+# libyaml's C loader when PyYAML was built with it, falling back to the pure python loader
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)  # pylint:disable=invalid-name
+# parsed yaml documents keyed by (path, mtime_ns, size), persisted between runs in a per project file under the user's
+#  CACHE_DIR.  Stored with marshal, which unlike pickle never runs code on load and, unlike json, keeps yaml's
+#  non-string dict keys (e.g. matchPort ports).  marshal isn't hardened against corrupt or crafted data either, so the
+#  file starts with a tag naming the format, python and marshal versions, and a checksum of the marshalled data, and
+#  anything which doesn't match is discarded before being unmarshalled
+YAML_CACHE_FILE = 'profile_strategies.{project}.cache'
+_YAML_CACHE_TAG = f"astrolabe-profile-strategies:1:{sys.version_info[0]}.{sys.version_info[1]}:{marshal.version}\n"
 
 
 def init():
@@ -93,22 +201,146 @@ def init():
     _load_profile_strategies()
 
 
+def get_profile_strategies(provider_ref: str) -> List[ProfileStrategy]:
+    """
+    Loaded profile strategies which profile using the provider `provider_ref`, in load order
+
+    :param provider_ref: the provider ref
+    :return: the profile strategies
+    """
+    return _profile_strategies_by_provider.get(provider_ref, [])
+
+
 def _load_profile_strategies():
+    # cleared in place rather than rebound, so a reload replaces rather than appends to what was loaded before
+    profile_strategies.clear()
+    _profile_strategies_by_provider.clear()
+    cache = _read_yaml_cache()
+    fresh_cache = {}
     for file in config.get_config_yaml_files():
-        with open(file, 'r', encoding='utf-8') as stream:
-            dcts = safe_load_all(stream)
-            for dct in dcts:
-                if 'ProfileStrategy' == dct.get('type'):
-                    protocol = network.get_protocol(dct['protocol'])
-                    pfs = ProfileStrategy(
-                        dct['description'],
-                        dct['name'],
-                        protocol,
-                        dct['providers'],
-                        dct['providerArgs'],
-                        dct['childProvider'],
-                        dct['serviceNameFilter'] if 'serviceNameFilter' in dct else {}
-                    )
-                    profile_strategies.append(pfs)
-                    logs.logger.debug('Loaded ProfileStrategy:')
-                    logs.logger.debug(pfs)
+        stat = os.stat(file)
+        key = (file, stat.st_mtime_ns, stat.st_size)
+        dcts = cache.get(key)
+        if dcts is None:
+            dcts = _parse_yaml_file(file)
+        fresh_cache[key] = dcts
+        for dct in dcts:
+            if 'ProfileStrategy' == dct.get('type'):
+                protocol = network.get_protocol(dct['protocol'])
+                pfs = ProfileStrategy(
+                    dct['description'],
+                    sys.intern(dct['name']),
+                    protocol,
+                    [sys.intern(provider) for provider in dct['providers']],
+                    dct['providerArgs'],
+                    _intern_child_provider(dct['childProvider']),
+                    dct['serviceNameFilter'] if 'serviceNameFilter' in dct else {}
+                )
+                profile_strategies.append(pfs)
+                for provider in pfs.providers:
+                    _profile_strategies_by_provider.setdefault(provider, []).append(pfs)
+                logs.logger.debug('Loaded ProfileStrategy:')
+                logs.logger.debug(pfs)
+    if fresh_cache != cache:
+        _write_yaml_cache(fresh_cache)
+
+
+def _intern_child_provider(child_provider: dict) -> dict:
+    """
+    Copy of child_provider with its provider refs interned.  The refs become Node.provider values which are
+    compared and used as dict keys throughout discovery
+
+    :param child_provider: the childProvider config from yaml
+    :return: the same config with interned provider refs
+    """
+    interned = {key: sys.intern(value) if isinstance(value, str) else value for key, value in child_provider.items()}
+    if isinstance(interned.get('matches'), dict):
+        interned['matches'] = {match: sys.intern(provider) if isinstance(provider, str) else provider
+                               for match, provider in interned['matches'].items()}
+    return interned
+
+
+def _parse_yaml_file(file: str) -> List[dict]:
+    """
+    Parse the ProfileStrategy documents in a yaml file.  Documents are composed one at a time and only constructed
+    into python objects when their top level `type` is ProfileStrategy, other documents are dropped as nodes
+
+    :param file: path to the yaml file
+    :return: the ProfileStrategy documents
+    """
+    # read the whole file up front so the loader scans one buffer rather than calling back into read()
+    with open(file, 'rb') as stream:
+        data = stream.read()
+    loader = _YAML_LOADER(data)
+    try:
+        dcts = []
+        while loader.check_node():
+            node = loader.get_node()
+            if _is_profile_strategy_node(node):
+                dcts.append(loader.construct_document(node))
+        return dcts
+    finally:
+        loader.dispose()
+
+
+def _is_profile_strategy_node(node: yaml.Node) -> bool:
+    if not isinstance(node, yaml.MappingNode):
+        return False
+    for key_node, value_node in node.value:
+        if isinstance(key_node, yaml.ScalarNode) and 'type' == key_node.value:
+            return isinstance(value_node, yaml.ScalarNode) and 'ProfileStrategy' == value_node.value
+    return False
+
+
+def _yaml_cache_path() -> str:
+    project = hashlib.sha256(str(config.ASTROLABE_DIR.resolve()).encode()).hexdigest()[:16]
+    return str(config.CACHE_DIR / YAML_CACHE_FILE.format(project=project))
+
+
+def _read_yaml_cache() -> Dict[Tuple[str, int, int], List[dict]]:
+    path = _yaml_cache_path()
+    if not os.path.exists(path):
+        return {}
+    tag = _YAML_CACHE_TAG.encode()
+    try:
+        with open(path, 'rb') as stream:
+            data = stream.read()
+        checksum, marshalled = data[len(tag):len(tag) + 32], data[len(tag) + 32:]
+        if not data.startswith(tag) or hashlib.sha256(marshalled).digest() != checksum:
+            logs.logger.debug('Ignoring stale or corrupt ProfileStrategy cache %s', path)
+            return {}
+        cache = marshal.loads(marshalled)
+    except Exception as exc:  # pylint:disable=broad-exception-caught
+        # an unreadable cache file is only ever a cache miss
+        logs.logger.debug('Ignoring unreadable ProfileStrategy cache %s: %s', path, exc)
+        return {}
+    if not _is_yaml_cache(cache):
+        logs.logger.debug('Ignoring malformed ProfileStrategy cache %s', path)
+        return {}
+    return cache
+
+
+def _is_yaml_cache(cache) -> bool:
+    if not isinstance(cache, dict):
+        return False
+    for key, dcts in cache.items():
+        if not (isinstance(key, tuple) and 3 == len(key) and isinstance(dcts, list)):
+            return False
+        if not all(isinstance(dct, dict) for dct in dcts):
+            return False
+    return True
+
+
+def _write_yaml_cache(cache: Dict[Tuple[str, int, int], List[dict]]) -> None:
+    path = _yaml_cache_path()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        marshalled = marshal.dumps(cache)
+        os.makedirs(config.CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'wb') as stream:
+            stream.write(_YAML_CACHE_TAG.encode() + hashlib.sha256(marshalled).digest() + marshalled)
+        os.replace(tmp_path, path)
+    except (OSError, ValueError) as exc:  # ValueError: a yaml value marshal can't store, e.g. a timestamp
+        logs.logger.debug('Unable to write ProfileStrategy cache %s: %s', path, exc)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
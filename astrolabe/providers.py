@@ -10,12 +10,14 @@ License:
 SPDX-License-Identifier: Apache-2.0
 """
 
-from typing import List, Optional
+import asyncio
+import functools
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
 import configargparse
 
 from astrolabe import constants, logs
-from astrolabe.network import Hint
+from astrolabe.network import Hint, Protocol
 from astrolabe.node import NodeTransport
 from astrolabe.plugin_core import PluginInterface, PluginFamilyRegistry
 from astrolabe.profile_strategy import ProfileStrategy
@@ -39,6 +41,8 @@ class ProviderInterface(PluginInterface):
         """
         return False
 
+    # the default implementations below are no-ops which ignore their arguments
+    # pylint:disable=unused-argument
     async def open_connection(self, address: str) -> Optional[type]:
         """
         Optionally open a connection which can then be passed into lookup_name() and discover()
@@ -48,7 +52,6 @@ class ProviderInterface(PluginInterface):
         :raises:
             TimeoutException - Timeout connecting to provider for name lookup
         """
-        del address
         return None
 
     async def lookup_name(self, address: str, connection: Optional[type]) -> Optional[str]:
@@ -64,7 +67,6 @@ class ProviderInterface(PluginInterface):
         :raises:
             NameLookupFailedException - Not able to find a name in the provider
         """
-        del address, connection
         return None
 
     async def sidecar(self, address: str, connection: Optional[type]) -> Optional[str]:
@@ -79,7 +81,6 @@ class ProviderInterface(PluginInterface):
         :raises:
             NameLookupFailedException - Not able to find a name in the provider
         """
-        del address, connection
         return None
 
     async def take_a_hint(self, hint: Hint) -> List[NodeTransport]:
@@ -91,7 +92,6 @@ class ProviderInterface(PluginInterface):
         :param hint: take this hint
         :return:
         """
-        del hint
         return []
 
     async def profile(self, address: str, pfss: List[ProfileStrategy], connection: Optional[type])\
@@ -109,11 +109,22 @@ class ProviderInterface(PluginInterface):
 
         :return: the children as a list of Node()s
         """
-        del address, connection, pfss
         return []
+    # pylint:enable=unused-argument
 
 
 _provider_registry = PluginFamilyRegistry(ProviderInterface)
+_sidecar_dnslookups_inflight: Dict[str, asyncio.Future] = {}  # {hostname: Future}
+# profile strategy response header label -> NodeTransport field
+_PROFILE_STRATEGY_RESPONSE_FIELD_MAP = {
+    'mux': 'protocol_mux',
+    'address': 'address',
+    'id': 'debug_identifier',
+    'conns': 'num_connections',
+    'metadata': 'metadata'
+}
+# (NodeTransport field, value) pairs in a profile strategy response which mean "no value"
+_PROFILE_STRATEGY_RESPONSE_NULL_SENTINELS = frozenset({('address', 'null')})
 
 
 def parse_provider_args(argparser: configargparse.ArgParser, disabled_provider_refs: Optional[List[str]] = None):
@@ -121,56 +132,95 @@ def parse_provider_args(argparser: configargparse.ArgParser, disabled_provider_r
 
 
 def register_providers():
-    _provider_registry.register_plugins(constants.ARGS.disable_providers)
+    _provider_registry.register_plugins(constants.ARGS.disable_providers, constants.ARGS.init_timeout)
+    get_provider_by_ref.cache_clear()
 
 
 def cleanup_providers():
     _provider_registry.cleanup_plugins()
+    get_provider_by_ref.cache_clear()
 
 
+@functools.lru_cache(maxsize=None)  # invalid refs exit rather than return, so they are never cached
 def get_provider_by_ref(provider_ref: str) -> ProviderInterface:
     return _provider_registry.get_plugin(provider_ref)
 
 
+async def coalesce_sidecar_dnslookups(hostnames: List[str],
+                                      lookup: Callable[[List[str]], Awaitable[None]]) -> None:
+    """
+    Sidecars on every profiled node attempt DNS lookups for all hostnames pending lookup.  Rather than have every
+    node look up the same hostnames at the same time, a hostname already being looked up by another node's sidecar
+    is skipped here instead of being looked up again.  It isn't waited on either: nothing in this node's discovery
+    depends on it, and a failed or hung lookup is then only ever reported against the node which started it.
+
+    :param hostnames: the hostnames pending lookup
+    :param lookup: coroutine function which looks up (and persists) a list of hostnames
+    """
+    to_lookup = [h for h in hostnames if h not in _sidecar_dnslookups_inflight]
+    if not to_lookup:
+        return
+    lookup_future = asyncio.ensure_future(lookup(to_lookup))
+    for hostname in to_lookup:
+        _sidecar_dnslookups_inflight[hostname] = lookup_future
+
+    def _clear_inflight(_):
+        for hostname in to_lookup:
+            _sidecar_dnslookups_inflight.pop(hostname, None)
+    lookup_future.add_done_callback(_clear_inflight)
+    # other sidecars skipped these hostnames, so the lookup runs to completion even if this sidecar times out
+    await asyncio.shield(lookup_future)
+
+
 def parse_profile_strategy_response(response: str, host_address: str, pfs: ProfileStrategy) -> List[NodeTransport]:
-    lines = response.splitlines()
-    if len(lines) < 2:
+    header_line, newline, body = response.partition('\n')
+    if not newline or not body:  # empty or header only responses are common, bail before splitting anything
         return []
-    header_line = lines.pop(0)
+    data_lines = body.splitlines()
+    # resolve the header once, each data line then only has to be split and zipped against it
+    targets = tuple(_PROFILE_STRATEGY_RESPONSE_FIELD_MAP.get(label) for label in header_line.split())
+    # constant for the whole response, resolved once rather than per line
+    from_hint = constants.PROVIDER_HINT in pfs.providers
+    pfs_name, protocol, determine_child_provider = pfs.name, pfs.protocol, pfs.determine_child_provider
     node_transports = [
         _create_node_transport_from_profile_strategy_response_line(
-            header_line, data_line, pfs
-        ) for data_line in lines
+            targets, data_line, pfs_name, protocol, from_hint, determine_child_provider
+        ) for data_line in data_lines
     ]
     logs.logger.debug("Found %d profile results for %s, profile strategy: \"%s\"..",
                       len(node_transports), host_address, pfs.name)
     return node_transports
 
 
-def _create_node_transport_from_profile_strategy_response_line(header_line: str, data_line: str, pfs: ProfileStrategy):
-    field_map = {
-        'mux': 'protocol_mux',
-        'address': 'address',
-        'id': 'debug_identifier',
-        'conns': 'num_connections',
-        'metadata': 'metadata'
-    }
+def _create_node_transport_from_profile_strategy_response_line(  # pylint:disable=too-many-arguments
+        targets: Tuple[Optional[str], ...], data_line: str, pfs_name: str, protocol: Protocol, from_hint: bool,
+        determine_child_provider: Callable[..., Optional[str]]):
     fields = {}
-    for label, value in zip(header_line.split(), data_line.split()):
-        if label == 'address' and value == 'null':
+    # columns past the header are dropped by zip(), so don't tokenize them: they're left as one trailing chunk
+    for target, value in zip(targets, data_line.split(None, len(targets))):
+        if target is None:  # column we have no NodeTransport field for
             continue
-        fields[label] = value
+        if (target, value) in _PROFILE_STRATEGY_RESPONSE_NULL_SENTINELS:
+            continue
+        fields[target] = value
 
     # field transforms/requirements
-    if 'mux' not in fields:
+    protocol_mux = fields.get('protocol_mux')
+    if protocol_mux is None:
         raise CreateNodeTransportException("protocol_mux missing from profile strategy results")
-    if 'metadata' in fields:
-        fields['metadata'] = dict(tuple(i.split('=') for i in fields['metadata'].split(',')))
-    if 'conns' in fields:
-        fields['conns'] = int(fields['conns'])
+    metadata = fields.get('metadata')
+    if metadata is not None:
+        if ',' in metadata:
+            fields['metadata'] = {key: value for key, sep, value in
+                                  (pair.partition('=') for pair in metadata.split(',')) if sep}
+        else:  # single pair, the common case
+            key, sep, value = metadata.partition('=')
+            fields['metadata'] = {key: value} if sep else {}
+    num_connections = fields.get('num_connections')
+    if num_connections is not None:
+        fields['num_connections'] = int(num_connections)
 
     # provider
-    from_hint = constants.PROVIDER_HINT in pfs.providers
-    provider = pfs.determine_child_provider(fields['mux'], fields.get('address'))
-    return NodeTransport(profile_strategy_name=pfs.name, provider=provider, from_hint=from_hint,
-                         protocol=pfs.protocol, **{field_map[k]: v for k, v in fields.items() if v})
+    provider = determine_child_provider(protocol_mux, fields.get('address'))
+    return NodeTransport(profile_strategy_name=pfs_name, provider=provider, from_hint=from_hint,
+                         protocol=protocol, **fields)
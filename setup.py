@@ -30,6 +30,7 @@ setup(
         'coolname~=2.0',
         'faker>=4.1',
         'kubernetes_asyncio~=30.3',
+        'orjson~=3.9',
         'paramiko~=3.4',
         'pyyaml~=6.0',
         'graphviz>=0.13',
@@ -68,6 +68,8 @@ def ps_mock(protocol_fixture, mocker, mock_provider_ref) -> MagicMock:
     ps_mock.protocol = protocol_fixture
     ps_mock.provider_args = {}
     ps_mock.providers = [mock_provider_ref]
+    mocker.patch('astrolabe.profile_strategy.get_profile_strategies',
+                 side_effect=lambda provider_ref: [ps_mock] if provider_ref in ps_mock.providers else [])
 
     return ps_mock
 
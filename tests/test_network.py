@@ -302,3 +302,20 @@ service-name-rewrites:
 
     # act/assert
     assert 'bar-baz' == network.rewrite_service_name('foo', node_fixture)
+
+
+def test_rewrite_service_name_case_first_configured_match_wins(astrolabe_d, mocker, node_fixture):
+    """Rewrite service name using the first configured match found in the name"""
+    # arrange
+    mocker.patch('astrolabe.network._validate', return_value=None)
+    network_yaml = """
+service-name-rewrites:
+  bar: first
+  foo: second
+"""
+    _write_stub_network_yaml(astrolabe_d, network_yaml)
+    network.init()
+
+    # act/assert
+    assert 'first' == network.rewrite_service_name('foobar', node_fixture)
+    assert 'baz' == network.rewrite_service_name('baz', node_fixture)
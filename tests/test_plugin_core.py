@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 from astrolabe import plugin_core
 
@@ -60,3 +62,29 @@ def test_get_case_plugin_absent():
     with pytest.raises(SystemExit) as e_info:
         plugin_registry.get_plugin('not_present')
     assert 1 == e_info.value.code
+
+
+def test_init_case_plugin_init_timeout():
+    """A plugin whose init_async() hangs past the timeout fails registration, without holding up other plugins"""
+    # arrange
+    class PluginFamily(plugin_core.PluginInterface):
+        pass
+
+    class TestPluginHangs(PluginFamily):
+        async def init_async(self):
+            await asyncio.sleep(60)
+
+        @staticmethod
+        def ref():
+            return 'hangs'
+
+    class TestPluginInits(PluginFamily):
+        @staticmethod
+        def ref():
+            return 'inits'
+    plugin_registry = plugin_core.PluginFamilyRegistry(PluginFamily)
+
+    # act/assert
+    with pytest.raises(asyncio.TimeoutError):
+        plugin_registry.register_plugins(timeout=.01)
+    assert ['inits'] == plugin_registry.get_registered_plugin_refs()
@@ -1,5 +1,10 @@
+import hashlib
+import marshal
 import os
+import pickle
 from dataclasses import replace
+from pathlib import Path
+from typing import List, Optional
 import yaml
 
 import pytest
@@ -7,6 +12,22 @@ import pytest
 from astrolabe import profile_strategy
 
 
+@pytest.fixture(autouse=True)
+def cache_d(tmp_path, mocker) -> Path:
+    """Return temp cache dir, patching config.CACHE_DIR so that no test reads or writes the user's real cache"""
+    cache_d = tmp_path / 'cache'
+    mocker.patch('astrolabe.profile_strategy.config.CACHE_DIR', cache_d)
+
+    return cache_d
+
+
+@pytest.fixture(autouse=True)
+def loaded_profile_strategies(mocker):
+    """init() loads into module globals, patched per test so that loaded strategies don't leak between tests"""
+    mocker.patch('astrolabe.profile_strategy.profile_strategies', [])
+    mocker.patch('astrolabe.profile_strategy._profile_strategies_by_provider', {})
+
+
 # ProfileStrategy()
 class TestProfileStrategy:
     # def filter_service_name()
@@ -59,6 +80,30 @@ class TestProfileStrategy:
         # act/assert
         assert profile_strategy_fixture.determine_child_provider(port) == provider
 
+    @pytest.mark.parametrize('port,provider', [('80', 'abc'), ('8080', 'default'), ('not-a-port', 'default')])
+    def test_determine_child_provider_case_match_port_str_keys(self, profile_strategy_fixture, port, provider):
+        """Child provider for type: 'matchPort' handles quoted port keys and falls back to the default"""
+        # arrange
+        child_provider = {'type': 'matchPort', 'matches': {'80': 'abc'}, 'default': 'default'}
+        profile_strategy_fixture = replace(profile_strategy_fixture, child_provider=child_provider)
+
+        # act/assert
+        assert profile_strategy_fixture.determine_child_provider(port) == provider
+
+    def test_determine_child_provider_case_match_port_non_numeric_key(self, profile_strategy_fixture, mocker):
+        """A non-numeric matchPort key is skipped with a warning rather than failing to build the strategy"""
+        # arrange
+        warning_func = mocker.patch('astrolabe.profile_strategy.logs.logger.warning')
+        child_provider = {'type': 'matchPort', 'matches': {'http': 'abc', 80: 'efg'}, 'default': 'default'}
+
+        # act
+        profile_strategy_fixture = replace(profile_strategy_fixture, child_provider=child_provider)
+
+        # assert
+        assert profile_strategy_fixture.determine_child_provider('80') == 'efg'
+        assert profile_strategy_fixture.determine_child_provider('http') == 'default'
+        warning_func.assert_called_once()
+
     @pytest.mark.parametrize('address, provider', [('foo', 'bar'), ('1.2.3.4', 'baz'),
                                                    ('asdf-a7h5f8cndfy-74hf6', 'buzz'), ('asdf', 'qux')])
     def test_determine_child_provider_case_match_address(self, profile_strategy_fixture, address, provider):
@@ -78,6 +123,17 @@ class TestProfileStrategy:
         # act/assert
         assert profile_strategy_fixture.determine_child_provider('dummy_mux', address) == provider
 
+    @pytest.mark.parametrize('matches', [{'bar': 'first', 'foo': 'second'}, {'(b)ar': 'first', 'foo': 'second'}])
+    def test_determine_child_provider_case_match_address_order(self, profile_strategy_fixture, matches):
+        """Child provider for type: 'matchAddress' is the first configured pattern matching anywhere in the address"""
+        # arrange
+        child_provider = {'type': 'matchAddress', 'matches': matches, 'default': 'default'}
+        profile_strategy_fixture = replace(profile_strategy_fixture, child_provider=child_provider)
+
+        # act/assert
+        assert profile_strategy_fixture.determine_child_provider('dummy_mux', 'foobar') == 'first'
+        assert profile_strategy_fixture.determine_child_provider('dummy_mux', 'baz') == 'default'
+
     def test_determine_child_provider_case_null_address(self, profile_strategy_fixture):
         """Child provider determined correctly for type: 'matchAddress' with address == None"""
         # arrange
@@ -93,6 +149,15 @@ class TestProfileStrategy:
         # act/assert
         assert profile_strategy_fixture.determine_child_provider('dummy_mux', None) == provider
 
+    def test_determine_child_provider_case_unsupported_type(self, profile_strategy_fixture):
+        """An unsupported child provider type raises ProfileStrategyException"""
+        # arrange
+        profile_strategy_fixture = replace(profile_strategy_fixture, child_provider={'type': 'matchFoo'})
+
+        # act/assert
+        with pytest.raises(profile_strategy.ProfileStrategyException):
+            profile_strategy_fixture.determine_child_provider('dummy_mux')
+
 
 # init()
 def test_init_case_inits_network(astrolabe_d, core_astrolabe_d, mocker):  # pylint:disable=unused-argument
@@ -150,3 +215,129 @@ protocol: "{protocol}"
     assert child_provider == parsed_cs.child_provider
     assert flter == parsed_cs.service_name_filter
     get_protocol_func.assert_called_once_with('BAZ')
+
+
+def _write_profile_strategy_yaml(astrolabe_d: Path, providers: Optional[List[str]] = None,
+                                 child_provider: Optional[dict] = None) -> None:
+    """Write a Foo ProfileStrategy yaml file into the (patched) astrolabe.d dir"""
+    fake_profile_strategy_yaml = f"""
+---
+type: "ProfileStrategy"
+name: "Foo"
+description: "Foo ProfileStrategy"
+{yaml.dump({'providers': providers or ['bar']})}
+protocol: "BAZ"
+providerArgs: {{}}
+{yaml.dump({'childProvider': child_provider or {'type': 'matchAll', 'provider': 'buz'}})}
+"""
+    with open(os.path.join(astrolabe_d, 'Foo.yaml'), 'w', encoding='utf8') as open_file:
+        open_file.write(fake_profile_strategy_yaml)
+
+
+def test_init_case_unchanged_yaml_loaded_from_cache(astrolabe_d, core_astrolabe_d, mocker):
+    """Charlotte reuses parsed yaml from the cache on a later run when the file is unchanged"""
+    # arrange
+    mocker.patch('astrolabe.profile_strategy.network.init')
+    mocker.patch('astrolabe.profile_strategy.network.get_protocol')
+    _write_profile_strategy_yaml(astrolabe_d)
+    profile_strategy.init()
+    parse_func = mocker.patch('astrolabe.profile_strategy._parse_yaml_file')
+
+    # act
+    profile_strategy.init()
+
+    # assert
+    parse_func.assert_not_called()
+    assert os.path.exists(profile_strategy._yaml_cache_path())  # pylint:disable=protected-access
+    assert ['Foo'] == [pfs.name for pfs in profile_strategy.profile_strategies]
+
+
+def _cache_file_contents(marshalled: bytes, checksum: Optional[bytes] = None) -> bytes:
+    tag = profile_strategy._YAML_CACHE_TAG.encode()  # pylint:disable=protected-access
+    return tag + (checksum or hashlib.sha256(marshalled).digest()) + marshalled
+
+
+@pytest.mark.parametrize('cache_contents', [
+    b'\x00garbage',  # untagged
+    pickle.dumps(['not', 'a', 'cache']),  # untagged
+    _cache_file_contents(marshal.dumps({}), checksum=bytes(32)),  # checksum mismatch
+    _cache_file_contents(b'\xff'),  # not unmarshallable
+    _cache_file_contents(marshal.dumps([1]))  # not a cache
+])
+def test_init_case_unreadable_cache_ignored(astrolabe_d, core_astrolabe_d, cache_d, mocker, cache_contents):
+    """Charlotte ignores a cache file she can't read, and parses the yaml instead"""
+    # arrange
+    mocker.patch('astrolabe.profile_strategy.network.init')
+    mocker.patch('astrolabe.profile_strategy.network.get_protocol')
+    _write_profile_strategy_yaml(astrolabe_d)
+    os.makedirs(cache_d)
+    with open(profile_strategy._yaml_cache_path(), 'wb') as open_file:  # pylint:disable=protected-access
+        open_file.write(cache_contents)
+
+    # act
+    profile_strategy.init()
+
+    # assert
+    assert ['Foo'] == [pfs.name for pfs in profile_strategy.profile_strategies]
+
+
+def test_init_case_port_matches_loaded_from_cache(astrolabe_d, core_astrolabe_d, mocker):
+    """Charlotte gets back the int port keys of a matchPort childProvider from the cache, just as yaml gave them"""
+    # arrange
+    mocker.patch('astrolabe.profile_strategy.network.init')
+    mocker.patch('astrolabe.profile_strategy.network.get_protocol')
+    _write_profile_strategy_yaml(astrolabe_d, child_provider={'type': 'matchPort', 'matches': {80: 'buz'}})
+    profile_strategy.init()
+    mocker.patch('astrolabe.profile_strategy._parse_yaml_file')
+
+    # act
+    profile_strategy.init()
+
+    # assert
+    assert {80: 'buz'} == profile_strategy.profile_strategies[0].child_provider['matches']
+
+
+def test_get_profile_strategies(astrolabe_d, core_astrolabe_d, mocker):
+    """Loaded profile strategies are looked up by each of their providers"""
+    # arrange
+    mocker.patch('astrolabe.profile_strategy.network.init')
+    mocker.patch('astrolabe.profile_strategy.network.get_protocol')
+    _write_profile_strategy_yaml(astrolabe_d, providers=['bar', 'baz'])
+
+    # act
+    profile_strategy.init()
+
+    # assert
+    assert ['Foo'] == [pfs.name for pfs in profile_strategy.get_profile_strategies('bar')]
+    assert ['Foo'] == [pfs.name for pfs in profile_strategy.get_profile_strategies('baz')]
+    assert [] == profile_strategy.get_profile_strategies('buz')
+
+
+def test_init_case_skips_non_profile_strategy_documents(astrolabe_d, core_astrolabe_d, mocker):
+    """Charlotte only loads the ProfileStrategy documents from a yaml file"""
+    # arrange
+    mocker.patch('astrolabe.profile_strategy.network.init')
+    mocker.patch('astrolabe.profile_strategy.network.get_protocol')
+    fake_profile_strategy_yaml = """
+---
+type: "Other"
+name: "Bar"
+---
+- not a mapping
+---
+type: "ProfileStrategy"
+name: "Foo"
+description: "Foo ProfileStrategy"
+providers: ["bar"]
+protocol: "BAZ"
+providerArgs: {}
+childProvider: {"type": "matchAll", "provider": "buz"}
+"""
+    with open(os.path.join(astrolabe_d, 'Foo.yaml'), 'w', encoding='utf8') as open_file:
+        open_file.write(fake_profile_strategy_yaml)
+
+    # act
+    profile_strategy.init()
+
+    # assert
+    assert ['Foo'] == [pfs.name for pfs in profile_strategy.profile_strategies]
@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 
 from astrolabe import providers, node, constants
@@ -101,6 +103,44 @@ def test_parse_profile_strategy_response_case_all_fields(ps_mock):
     assert res == expected
 
 
+def test_parse_profile_strategy_response_case_unknown_column(ps_mock):
+    # arrange
+    protocol_mux = 'foo'
+    profile_strategy_response = f"pid mux\n1234 {protocol_mux}"
+    provider = 'FAKE'
+    ps_mock.determine_child_provider.return_value = provider
+    expected = [node.NodeTransport(ps_mock.name, provider, ps_mock.protocol, protocol_mux)]
+
+    # act/assert
+    res = providers.parse_profile_strategy_response(profile_strategy_response, '', ps_mock)
+    assert res == expected
+
+
+def test_parse_profile_strategy_response_case_malformed_metadata(ps_mock):
+    # arrange
+    profile_strategy_response = "mux metadata\nfoo pet=dog,,stray,url=a=b,"
+    ps_mock.determine_child_provider.return_value = 'FAKE'
+
+    # act
+    res = providers.parse_profile_strategy_response(profile_strategy_response, '', ps_mock)
+
+    # assert
+    assert res[0].metadata == {'pet': 'dog', 'url': 'a=b'}
+
+
+def test_parse_profile_strategy_response_case_zero_conns(ps_mock):
+    """0 connections is kept on the NodeTransport, not dropped as an empty value"""
+    # arrange
+    profile_strategy_response = "mux conns\nfoo 0"
+    ps_mock.determine_child_provider.return_value = 'FAKE'
+
+    # act
+    res = providers.parse_profile_strategy_response(profile_strategy_response, '', ps_mock)
+
+    # assert
+    assert res[0].num_connections == 0
+
+
 @pytest.mark.parametrize('provider,from_hint', [(constants.PROVIDER_HINT, True), ('FAKE', False)])
 def test_parse_profile_strategy_response_case_hint(ps_mock, provider, from_hint):
     # arrange
@@ -111,3 +151,87 @@ def test_parse_profile_strategy_response_case_hint(ps_mock, provider, from_hint)
     # act/assert
     res = providers.parse_profile_strategy_response(profile_strategy_response, '', ps_mock)
     assert res[0].from_hint == from_hint
+
+
+@pytest.mark.asyncio
+async def test_coalesce_sidecar_dnslookups_case_inflight_hostname_not_looked_up_again():
+    """A hostname already being looked up by another sidecar is not looked up a second time"""
+    # arrange
+    looked_up = []
+    release = asyncio.Event()
+
+    async def _lookup(hostnames):
+        looked_up.append(hostnames)
+        await release.wait()
+
+    # act
+    first = asyncio.ensure_future(providers.coalesce_sidecar_dnslookups(['foo', 'bar'], _lookup))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(providers.coalesce_sidecar_dnslookups(['bar', 'baz'], _lookup))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(first, second)
+
+    # assert
+    assert looked_up == [['foo', 'bar'], ['baz']]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_sidecar_dnslookups_case_completed_hostname_looked_up_again():
+    """Once a lookup completes the hostname is no longer in flight, and may be looked up by the next sidecar"""
+    # arrange
+    looked_up = []
+
+    async def _lookup(hostnames):
+        looked_up.append(hostnames)
+
+    # act
+    await providers.coalesce_sidecar_dnslookups(['foo'], _lookup)
+    await providers.coalesce_sidecar_dnslookups(['foo'], _lookup)
+
+    # assert
+    assert looked_up == [['foo'], ['foo']]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_sidecar_dnslookups_case_inflight_hostname_not_waited_on():
+    """A sidecar doesn't wait on a lookup started by another sidecar, so it can't hang or fail with it"""
+    # arrange
+    release = asyncio.Event()
+
+    async def _lookup(_):
+        await release.wait()
+        raise RuntimeError('lookup failed')
+
+    first = asyncio.ensure_future(providers.coalesce_sidecar_dnslookups(['foo'], _lookup))
+    await asyncio.sleep(0)
+
+    # act
+    second = await asyncio.wait_for(providers.coalesce_sidecar_dnslookups(['foo'], _lookup), timeout=1)
+    release.set()
+
+    # assert
+    assert second is None
+    with pytest.raises(RuntimeError):
+        await first
+
+
+@pytest.mark.asyncio
+async def test_coalesce_sidecar_dnslookups_case_timeout_does_not_cancel_lookup():
+    """A sidecar timing out doesn't cancel its lookup, which other sidecars skipped the hostnames of"""
+    # arrange
+    looked_up = []
+    release = asyncio.Event()
+
+    async def _lookup(hostnames):
+        await release.wait()
+        looked_up.append(hostnames)
+
+    # act
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(providers.coalesce_sidecar_dnslookups(['foo'], _lookup), timeout=0.01)
+    release.set()
+    await asyncio.sleep(0)
+
+    # assert
+    assert looked_up == [['foo']]